@@ -1,21 +1,39 @@
 import streamlit as st
-from data_loader import load_movies
+from data_loader import load_movies, normalize_title, source_version
 from recommendation_engine import MovieRecommender
-from poster_api import get_movie_poster
+from poster_api import get_movie_posters, prefetch_posters
 import urllib.parse
+from functools import lru_cache
+from collections import OrderedDict
+import string
 import os
+import logging
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Number of recommendations shown before the "Show more" expander
+INITIAL_RECOMMENDATIONS = 5
+
+# Most-voted movies whose posters are fetched in the background at startup
+PREFETCH_POSTERS = 500
+
+# Searches whose results are kept per session for instant re-display
+RESULTS_CACHE_SIZE = 32
+
 # Configure the page
 st.set_page_config(
     page_title="CineMatch | Your Personal Movie Guide",
     page_icon="🎬"
 )
 
-# Add custom CSS
+# Add custom CSS. This runs once per full script run; fragment reruns of
+# the recommendations panel leave it in place
 st.markdown("""
     <style>
         .poster-container {
@@ -59,17 +77,40 @@ st.markdown("""
                 0 0 20px rgba(255,255,255,0.2);
         }
         
-        .poster-inner img {
+        .poster-container img {
             width: 100%;
             height: 100%;
             object-fit: cover;
-            display: block;
             border-radius: 10px;
-            transition: transform 0.3s ease-out;
+            box-shadow: 0 4px 8px rgba(0,0,0,0.1);
+            transition: box-shadow 0.3s;
+        }
+        
+        .poster-container:hover img {
+            box-shadow: 0 6px 12px rgba(0,0,0,0.2);
         }
         
-        .poster-container:hover .poster-inner img {
-            transform: scale(1.05);
+        .rec-row {
+            display: grid;
+            grid-template-columns: 1fr 2fr 1fr;
+            gap: 1rem;
+            align-items: center;
+            padding: 1rem 0;
+            border-bottom: 1px solid rgba(49, 51, 63, 0.2);
+        }
+        
+        .no-poster {
+            width: 150px;
+            height: 225px;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            background: #f0f2f6;
+            border-radius: 10px;
+            color: #666;
+            text-align: center;
+            font-size: 0.8em;
+            padding: 10px;
         }
         
         /* Style number input container */
@@ -97,136 +138,102 @@ st.markdown("""
         .movie-title:hover {
             color: #ff4b4b;
         }
-        
-        .movie-card {
-            display: inline-block;
-            margin: 10px;
-            text-align: center;
-            transition: transform 0.3s ease;
-        }
-        
-        .movie-card:hover {
-            transform: translateY(-5px);
-        }
     </style>
 """, unsafe_allow_html=True)
 
-def format_number(num):
-    """Format numbers for better readability"""
-    if num >= 1_000_000:
-        return f"{num/1_000_000:.1f}M"
-    elif num >= 1_000:
-        return f"{num/1_000:.1f}K"
-    return str(num)
+# HTML snippets for the recommendation rows, styled by the stylesheet above
+TITLE_TEMPLATE = string.Template(
+    '<a href="$url" target="_blank" style="text-decoration: none;">'
+    '<h3 class="movie-title">$title ($year)</h3>'
+    '</a>'
+)
+POSTER_TEMPLATE = string.Template(
+    '<div class="poster-container">'
+    '<a href="$link_url" target="_blank">'
+    '<img src="$url" alt="Movie Poster" loading="lazy">'
+    '</a>'
+    '</div>'
+)
+NO_POSTER_HTML = '<div class="no-poster">No poster available</div>'
+ROW_TEMPLATE = string.Template(
+    '<div class="rec-row">'
+    '<div class="rec-poster">$poster</div>'
+    '<div class="rec-meta">$title<p>Genres: $genres</p></div>'
+    '<div class="rec-stats"><p>⭐ $rating/10</p><p>📊 $match match</p></div>'
+    '</div>'
+)
 
+@lru_cache(maxsize=4096)
 def create_google_search_url(movie_title, year):
     """Create a Google search URL for a movie"""
     query = f"{movie_title} {year} movie"
     return f"https://www.google.com/search?q={urllib.parse.quote(query)}"
 
-def show_movie_title(title, year, url):
-    """Display movie title with enhanced styling"""
-    st.markdown(
-        f"""
-        <a href="{url}" target="_blank" style="text-decoration: none;">
-            <h3 class="movie-title">{title} ({year})</h3>
-        </a>
-        """,
-        unsafe_allow_html=True
-    )
+def movie_title_html(title, year, url):
+    """Build the movie title link with enhanced styling"""
+    return TITLE_TEMPLATE.substitute(url=url, title=title, year=year)
 
-def show_no_poster_placeholder():
-    """Display a placeholder when no movie poster is available"""
-    st.markdown(
-        """
-        <style>
-            .no-poster {
-                width: 150px;
-                height: 225px;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                background: #f0f2f6;
-                border-radius: 10px;
-                color: #666;
-                text-align: center;
-                font-size: 0.8em;
-                padding: 10px;
-            }
-        </style>
-        <div class="no-poster">
-            No poster available
-        </div>
-        """,
-        unsafe_allow_html=True
+def movie_poster_html(url, link_url):
+    """Build a movie poster with consistent styling"""
+    return POSTER_TEMPLATE.substitute(url=url, link_url=link_url)
+
+def recommendation_row_html(movie, poster_url, search_url):
+    """Build the HTML for a single recommended movie"""
+    if poster_url:
+        poster = movie_poster_html(poster_url, search_url)
+    else:
+        poster = NO_POSTER_HTML
+    
+    return ROW_TEMPLATE.substitute(
+        poster=poster,
+        title=movie_title_html(movie['title'], movie['year'], search_url),
+        genres=' '.join(movie['genres']),
+        rating=f"{movie['rating']:.1f}",
+        match=f"{movie['similarity_score']:.1%}"
     )
 
-def show_movie_poster(url, link_url):
-    """Display a movie poster with consistent styling"""
-    st.markdown(
-        f"""
-        <style>
-            .poster-container {{
-                width: 150px;
-                height: 225px;
-                border-radius: 10px;
-                overflow: hidden;
-                position: relative;
-            }}
-            
-            .poster-container img {{
-                width: 100%;
-                height: 100%;
-                object-fit: cover;
-                border-radius: 10px;
-                box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-                transition: box-shadow 0.3s;
-            }}
-            
-            .poster-container:hover img {{
-                box-shadow: 0 6px 12px rgba(0,0,0,0.2);
-            }}
-        </style>
-        <div class="poster-container">
-            <a href="{link_url}" target="_blank">
-                <img src="{url}" alt="Movie Poster">
-            </a>
-        </div>
-        """,
-        unsafe_allow_html=True
+def show_recommendation_rows(rows):
+    """Display recommended movies in a single markdown element"""
+    search_urls = [create_google_search_url(movie['title'], movie['year']) for movie, _ in rows]
+    html = ''.join(
+        recommendation_row_html(movie, poster_url, search_url)
+        for (movie, poster_url), search_url in zip(rows, search_urls)
     )
+    st.markdown(f'<div class="rec-grid">{html}</div>', unsafe_allow_html=True)
 
-def show_movie_card(title, poster_url, genres, overview):
-    """Display a movie card with poster and details"""
-    if not poster_url:
-        poster_url = "https://via.placeholder.com/150x225.png?text=No+Poster"
-    
-    html = f"""
-    <div class="movie-card">
-        <a href="https://www.google.com/search?q={urllib.parse.quote(f'{title} movie')}" target="_blank" style="text-decoration: none;">
-            <div class="poster-container">
-                <div class="poster-inner">
-                    <img src="{poster_url}" alt="{title} poster">
-                </div>
-                <div class="poster-description">
-                    <strong>Overview:</strong><br>
-                    {overview[:200] + '...' if len(overview) > 200 else overview}<br><br>
-                    <strong>Genres:</strong><br>
-                    {genres}
-                </div>
-            </div>
-            <h3 class="movie-title">{title}</h3>
-        </a>
-    </div>
-    """
-    st.markdown(html, unsafe_allow_html=True)
+def show_results(recommendations, poster_urls):
+    """Display recommended movies with their posters"""
+    if recommendations:
+        st.write("### 🎥 Recommended Movies:")
+        rows = list(zip(recommendations, poster_urls))
+        
+        # Render the top results right away and keep the rest
+        # collapsed so the first screen stays light
+        show_recommendation_rows(rows[:INITIAL_RECOMMENDATIONS])
+        
+        if len(rows) > INITIAL_RECOMMENDATIONS:
+            with st.expander("Show more recommendations", expanded=False):
+                show_recommendation_rows(rows[INITIAL_RECOMMENDATIONS:])
+    else:
+        st.warning("⚠️ No movies found or couldn't make recommendations.")
 
 def show_recommendations(recommender, movie_title, n_recommendations, api_token):
     """Display movie recommendations"""
     if not movie_title:
+        st.session_state.pop('last_results', None)
         st.warning("Please enter a movie title")
         return
             
+    # Searches already made in this session are shown again without
+    # recomputing recommendations or looking up posters
+    results_cache = st.session_state.setdefault('results_cache', OrderedDict())
+    key = (normalize_title(movie_title), n_recommendations)
+    if key in results_cache:
+        results_cache.move_to_end(key)
+        st.session_state.last_results = results_cache[key]
+        show_results(*results_cache[key])
+        return
+            
     with st.spinner('🔄 Finding recommendations...'):
         try:
             recommendations = recommender.find_similar_movies(
@@ -234,47 +241,73 @@ def show_recommendations(recommender, movie_title, n_recommendations, api_token)
                 n_recommendations
             )
             
-            if recommendations:
-                st.write("### 🎥 Recommended Movies:")
-                for movie in recommendations:
-                    with st.container():
-                        col1, col2, col3 = st.columns([1, 2, 1])
-                        
-                        # Get movie poster
-                        poster_url = get_movie_poster(api_token, movie['title'], movie['year'])
-                        
-                        with col1:
-                            if poster_url:
-                                search_url = create_google_search_url(movie['title'], movie['year'])
-                                show_movie_poster(poster_url, search_url)
-                            else:
-                                show_no_poster_placeholder()
-                        
-                        with col2:
-                            search_url = create_google_search_url(movie['title'], movie['year'])
-                            show_movie_title(movie['title'], movie['year'], search_url)
-                            st.write(f"Genres: {' '.join(movie['genres'])}")
-                        
-                        with col3:
-                            st.write(f"⭐ {movie['rating']:.1f}/10")
-                            st.write(f"📊 {movie['similarity_score']:.1%} match")
-                        
-                        st.write("---")
-            else:
-                st.warning("⚠️ No movies found or couldn't make recommendations.")
+            # Fetch all posters concurrently before rendering
+            poster_urls = get_movie_posters(
+                api_token,
+                [(movie['title'], movie['year']) for movie in recommendations]
+            ) if recommendations else []
+            
+            results_cache[key] = (recommendations, poster_urls)
+            if len(results_cache) > RESULTS_CACHE_SIZE:
+                results_cache.popitem(last=False)
+            
+            st.session_state.last_results = (recommendations, poster_urls)
+            show_results(recommendations, poster_urls)
         except Exception as e:
             st.error(f"Error finding recommendations: {str(e)}")
 
-@st.cache_resource
-def initialize_recommender():
-    """Initialize and cache the recommendation system"""
+@st.cache_resource(max_entries=1)
+def initialize_recommender(data_version):
+    """Initialize and cache the recommendation system for a version of the source data"""
     try:
-        movies_df = load_movies()
-        return MovieRecommender(movies_df)
+        movies_df, title_index = load_movies()
+        return MovieRecommender(movies_df, title_index)
     except Exception as e:
         st.error(f"Failed to initialize recommender: {str(e)}")
         return None
 
+@st.cache_resource
+def start_poster_prefetch(api_token, _recommender):
+    """Warm the poster cache for the most popular movies once per process"""
+    try:
+        top = _recommender.data.nlargest(PREFETCH_POSTERS, 'numVotes')
+        return prefetch_posters(api_token, list(zip(top['title'].tolist(), top['year'].tolist())))
+    except Exception as e:
+        logger.warning(f"Failed to start poster prefetch: {str(e)}")
+        return None
+
+@st.fragment
+def recommender_panel(recommender, api_token):
+    """Search form and results, rerun on their own when the form is submitted"""
+    try:
+        # Create the search interface. The inputs sit in a form so typing
+        # doesn't rerun anything; recommendations are computed on submit
+        with st.form("rec_form"):
+            movie_title = st.text_input("🔍 Enter a movie title:")
+            
+            # Create a container for number input
+            st.markdown('<div style="margin-top: 1rem;">Number of recommendations:</div>', unsafe_allow_html=True)
+            n_recommendations = st.number_input(
+                "Number of recommendations",
+                min_value=5,
+                max_value=20,
+                value=10,
+                step=1,
+                label_visibility="visible"
+            )
+            
+            submitted = st.form_submit_button("🎯 Show Recommendations")
+        
+        # Show recommendations on submit, and keep the last results on
+        # screen across other reruns
+        if submitted:
+            show_recommendations(recommender, movie_title, n_recommendations, api_token)
+        elif 'last_results' in st.session_state:
+            show_results(*st.session_state.last_results)
+                
+    except Exception as e:
+        st.error(f"An error occurred: {str(e)}")
+
 def main():
     st.title("🎬 CineMatch: Your Personal Movie Guide")
     st.write("Discover your next favorite movie with AI-powered recommendations")
@@ -292,37 +325,20 @@ def main():
         return
     
     try:
-        # Initialize session state
-        if 'previous_search' not in st.session_state:
-            st.session_state.previous_search = ""
-            
-        # Initialize recommender
-        recommender = initialize_recommender()
+        # Initialize recommender; the source data version is part of the
+        # cache key so changed TSVs are picked up without a restart
+        recommender = initialize_recommender(source_version())
         
         if recommender is None:
             st.error("Failed to initialize the recommendation system. Please try again later.")
             return
         
-        # Create the search interface
-        movie_title = st.text_input("🔍 Enter a movie title:")
-        
-        # Create a container for number input
-        st.markdown('<div style="margin-top: 1rem;">Number of recommendations:</div>', unsafe_allow_html=True)
-        n_recommendations = st.number_input(
-            "Number of recommendations",
-            min_value=5,
-            max_value=20,
-            value=10,
-            step=1,
-            label_visibility="visible"
-        )
+        # Popular movies are the most likely results, so get their posters
+        # ready without blocking the page
+        start_poster_prefetch(api_token, recommender)
         
-        # Show recommendations when input changes
-        current_search = f"{movie_title}_{n_recommendations}"
-        if current_search != st.session_state.previous_search:
-            if movie_title:
-                show_recommendations(recommender, movie_title, n_recommendations, api_token)
-            st.session_state.previous_search = current_search
+        # Only the panel reruns on input changes, not the whole page
+        recommender_panel(recommender, api_token)
                 
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
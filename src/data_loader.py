@@ -1,117 +1,236 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pacsv
 import logging
+import json
 from pathlib import Path
-import joblib
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Source data files
+RATINGS_FILE = Path("data") / "title.ratings.tsv"
+BASICS_FILE = Path("data") / "title.basics.tsv"
+
 # Cache settings
 CACHE_DIR = Path("cache")
-PROCESSED_DATA_CACHE = CACHE_DIR / "processed_movies.joblib"
+PROCESSED_DATA_CACHE = CACHE_DIR / "processed_movies.parquet"
+PROCESSED_DATA_META = CACHE_DIR / "processed_movies.meta.json"
+TITLE_INDEX_CACHE = CACHE_DIR / "title_index.json"
+
+# Bytes of TSV handed to each parser thread
+TSV_BLOCK_SIZE = 16 << 20
+
+def _read_tsv(path, column_types, keep=None):
+    """
+    Read selected columns of an IMDb TSV into an Arrow table, keeping
+    only the rows selected by the optional keep predicate
+    """
+    # IMDb marks missing values as \N, so only that token is treated as null
+    # (this applies to non-string columns, strings keep the literal \N)
+    table = pacsv.read_csv(
+        path,
+        read_options=pacsv.ReadOptions(use_threads=True, block_size=TSV_BLOCK_SIZE),
+        parse_options=pacsv.ParseOptions(delimiter='\t'),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=list(column_types),
+            column_types=column_types,
+            null_values=['\\N']
+        )
+    )
+    
+    if keep is not None:
+        table = table.filter(keep(table))
+        
+    return table
+
+def _with_numeric_tconst(table):
+    """Replace the tt-prefixed tconst strings of a table with int32 ids"""
+    ids = pc.utf8_slice_codeunits(table['tconst'], 2).cast(pa.int32())
+    return table.set_column(table.schema.get_field_index('tconst'), 'tconst', ids)
+
+def _source_mtimes():
+    """Get modification times of the IMDb source files"""
+    return {str(path): path.stat().st_mtime for path in (RATINGS_FILE, BASICS_FILE)}
+
+def _sources_available():
+    """Check whether both IMDb source files are present"""
+    return all(path.exists() for path in (RATINGS_FILE, BASICS_FILE))
+
+def source_version():
+    """
+    Get a hashable version of the IMDb source files for cache keys, taken
+    from the cached mtimes when only the cache is shipped
+    """
+    if _sources_available():
+        return tuple(_source_mtimes().values())
+    try:
+        return tuple(json.loads(PROCESSED_DATA_META.read_text()).values())
+    except Exception:
+        return ()
+
+def normalize_title(title):
+    """Lowercase a title and collapse its whitespace for exact lookups"""
+    return ' '.join(title.lower().split())
+
+def build_title_index(df):
+    """
+    Map each normalized title to the last row of the first title normalizing
+    to it, which is the row a full fuzzy scan of the titles resolves to
+    """
+    # Duplicate titles keep their first position and their last row, and
+    # titles differing only in case or spacing keep the earliest spelling
+    last_rows = dict(zip(df['title'].tolist(), range(len(df))))
+    title_index = {}
+    for title, row in last_rows.items():
+        title_index.setdefault(normalize_title(title), row)
+    return title_index
+
+def _load_cache():
+    """
+    Load the processed movies and title index if the cache matches the
+    source files, or as they are if the source files are not shipped
+    """
+    try:
+        cache_files = (PROCESSED_DATA_CACHE, PROCESSED_DATA_META, TITLE_INDEX_CACHE)
+        if all(path.exists() for path in cache_files):
+            if not _sources_available():
+                logger.warning("Source data not found, loading processed movies from cache...")
+            elif json.loads(PROCESSED_DATA_META.read_text()) == _source_mtimes():
+                logger.info("Loading processed movies from cache...")
+            else:
+                logger.info("Source data changed, rebuilding processed movies...")
+                return None
+            # The file is mapped rather than read into an intermediate buffer
+            return (
+                pd.read_parquet(PROCESSED_DATA_CACHE, memory_map=True),
+                json.loads(TITLE_INDEX_CACHE.read_text())
+            )
+    except Exception as e:
+        logger.warning(f"Failed to load cache: {e}")
+    return None
+
+def _save_cache(df, title_index):
+    """Save the processed movies, their title index and the source mtimes they were built from"""
+    try:
+        logger.info("Caching processed data...")
+        CACHE_DIR.mkdir(exist_ok=True)
+        df.to_parquet(PROCESSED_DATA_CACHE, compression='zstd')
+        TITLE_INDEX_CACHE.write_text(json.dumps(title_index))
+        PROCESSED_DATA_META.write_text(json.dumps(_source_mtimes()))
+    except Exception as e:
+        logger.warning(f"Failed to save cache: {e}")
 
 def load_movies():
     """
-    Load and process IMDb movie data with caching
+    Load and process IMDb movie data with caching, returning the movies
+    and an index from lowercased title to row
     """
     try:
         # Try to load from cache first
-        if PROCESSED_DATA_CACHE.exists():
-            logger.info("Loading processed movies from cache...")
-            return joblib.load(PROCESSED_DATA_CACHE)
+        cached = _load_cache()
+        if cached is not None:
+            return cached
             
         logger.info("Loading IMDb data...")
         
-        # Load ratings data with specific dtypes
+        # Load popular, well-rated titles only, so the merge only sees
+        # the rows that can survive the final filter. Numbers are parsed
+        # straight into the narrowest types that fit IMDb's ranges
         logger.info("1/3 Loading ratings...")
-        ratings = pd.read_csv(
-            'data/title.ratings.tsv',
-            sep='\t',
-            usecols=['tconst', 'averageRating', 'numVotes'],
-            dtype={
-                'tconst': str,
-                'averageRating': float,
-                'numVotes': int
-            }
+        ratings = _read_tsv(
+            RATINGS_FILE,
+            {
+                'tconst': pa.string(),
+                'averageRating': pa.float32(),
+                'numVotes': pa.int32()
+            },
+            keep=lambda table: pc.and_(
+                pc.greater_equal(table['numVotes'], 10000),      # Popular movies
+                pc.greater_equal(table['averageRating'], 5.0)    # Well-rated movies
+            )
         )
+        rated_tconsts = ratings['tconst'].combine_chunks()
         
-        # Load movie basics with specific dtypes
+        # Load modern movies with known genres that have a rating. The
+        # selected columns of the whole basics file are parsed in parallel
+        # and then filtered by Arrow kernels, trading peak memory for
+        # parse time
         logger.info("2/3 Loading movie information...")
-        movies = pd.read_csv(
-            'data/title.basics.tsv',
-            sep='\t',
-            usecols=['tconst', 'titleType', 'primaryTitle', 'startYear', 'genres'],
-            dtype={
-                'tconst': str,
-                'titleType': str,
-                'primaryTitle': str,
-                'startYear': str,
-                'genres': str
-            }
+        movies = _read_tsv(
+            BASICS_FILE,
+            {
+                'tconst': pa.string(),
+                'titleType': pa.string(),
+                'primaryTitle': pa.string(),
+                'startYear': pa.int16(),
+                'genres': pa.string()
+            },
+            keep=lambda table: pc.and_(
+                pc.and_(
+                    pc.equal(table['titleType'], 'movie'),
+                    pc.not_equal(table['genres'], '\\N')
+                ),
+                pc.and_(
+                    pc.greater_equal(table['startYear'], 1970),  # Modern movies
+                    pc.is_in(table['tconst'], value_set=rated_tconsts)
+                )
+            )
         )
         
         # Clean and filter movies
         logger.info("3/3 Processing and filtering data...")
         
-        # Filter movies and clean data
-        movies = movies[
-            (movies['titleType'] == 'movie') & 
-            (movies['genres'] != '\\N') &
-            (movies['startYear'] != '\\N')
-        ]
-        
-        # Convert year to numeric, dropping invalid values
-        movies['startYear'] = pd.to_numeric(movies['startYear'], errors='coerce')
-        movies = movies.dropna(subset=['startYear'])
+        # Clean genres: split by comma. Genres are dictionary-encoded since
+        # the same combinations repeat across many movies, so the separator
+        # is rewritten by an Arrow kernel once per unique combination
+        # instead of once per row, and they reach pandas as a category
+        genres = pc.dictionary_encode(movies['genres'].combine_chunks())
+        genres = pa.DictionaryArray.from_arrays(
+            genres.indices,
+            pc.replace_substring(genres.dictionary, ',', ' ')
+        )
+        movies = movies.set_column(movies.schema.get_field_index('genres'), 'genres', genres)
         
-        # Clean genres: replace \N with empty string and split by comma
-        movies['genres'] = movies['genres'].str.replace('\\N', '')
-        movies['genres'] = movies['genres'].str.replace(',', ' ')
+        # Only the filtered rows are converted to pandas, without the
+        # titleType column that was only needed for filtering. The merge
+        # key is turned into an int32 id so the join hashes integers
+        # instead of Python strings
+        ratings = _with_numeric_tconst(ratings).to_pandas()
+        movies = _with_numeric_tconst(movies.drop_columns(['titleType'])).to_pandas()
         
         # Merge datasets
         logger.info("Merging datasets...")
         df = movies.merge(ratings, on='tconst', how='inner')
         
-        # Create final dataset with clean column names
+        # Create final dataset with clean column names; every filter has
+        # already been applied before the merge
         final_df = df[
-            (df['startYear'] >= 1970) &           # Modern movies
-            (df['numVotes'] >= 10000) &           # Popular movies
-            (df['averageRating'] >= 5.0)          # Well-rated movies
-        ].copy()
-        
-        # Rename columns for clarity
-        final_df = final_df.rename(columns={
+            ['primaryTitle', 'startYear', 'genres', 'averageRating', 'numVotes']
+        ].rename(columns={
             'primaryTitle': 'title',
             'startYear': 'year'
         })
         
-        # Select and order final columns
-        final_df = final_df[[
-            'title',
-            'year',
-            'genres',
-            'averageRating',
-            'numVotes'
-        ]]
+        # No nulls can remain: the filters above drop rows with a missing
+        # year, rating or vote count, and the merge already returns a
+        # fresh index
+        if logger.isEnabledFor(logging.DEBUG):
+            assert not final_df.isna().values.any(), "Unexpected null values"
+            logger.debug(f"Data shape: {final_df.shape}")
+            logger.debug(f"Columns: {final_df.columns.tolist()}")
+            logger.debug(f"Sample genres: {final_df['genres'].head().tolist()}")
         
-        # Remove any remaining null values
-        final_df = final_df.dropna()
-        
-        # Reset index
-        final_df = final_df.reset_index(drop=True)
-        
-        logger.info(f"Data shape: {final_df.shape}")
-        logger.info(f"Columns: {final_df.columns.tolist()}")
-        logger.info(f"Sample genres: {final_df['genres'].head().tolist()}")
+        # Build the title lookup once here so queries don't scan the titles
+        title_index = build_title_index(final_df)
         
         # Cache the processed data
-        logger.info("Caching processed data...")
-        CACHE_DIR.mkdir(exist_ok=True)
-        joblib.dump(final_df, PROCESSED_DATA_CACHE)
+        _save_cache(final_df, title_index)
         
         logger.info(f"Successfully loaded {len(final_df)} movies")
-        return final_df
+        return final_df, title_index
         
     except Exception as e:
         logger.error(f"Error loading movie data: {str(e)}")
@@ -1,10 +1,16 @@
+import diskcache
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import streamlit as st
 import os
 from dotenv import load_dotenv
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 import json
+from pathlib import Path
 from typing import Optional, Dict, Any
 
 # Load environment variables
@@ -14,6 +20,43 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Posters are shown at 150x225, so the w342 rendition covers 2x displays
+# at well under half the bytes of w500
+POSTER_IMAGE_BASE_URL = "https://image.tmdb.org/t/p/w342"
+
+# Persistent poster cache settings
+POSTER_CACHE_DIR = Path("cache") / "posters"
+POSTER_CACHE_EXPIRE = 60 * 60 * 24 * 30  # 30 days
+
+# On-disk (lowercased title, year) -> poster URL cache that survives restarts.
+# Misses are stored as None so unknown movies aren't searched again.
+_poster_cache = diskcache.Cache(str(POSTER_CACHE_DIR))
+_MISS = object()
+
+def _cache_key(title, year):
+    """Key the poster caches on the title as TMDB matches it, ignoring case"""
+    return (' '.join(title.lower().split()), year)
+
+# Concurrent poster searches per batch; kept below the pool size so every
+# worker gets a kept-alive connection
+POSTER_FETCH_WORKERS = 8
+
+# Connect and read timeouts in seconds, so a stalled TMDB connection
+# cannot hold a worker or the page indefinitely
+POSTER_REQUEST_TIMEOUT = (3, 10)
+
+# Shared HTTP session so poster searches reuse kept-alive TLS connections
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=20,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=[429, 500, 502, 503, 504]
+    )
+))
+
 class MoviePosterAPI:
     def __init__(self, api_token=None):
         """Initialize the TMDB API client"""
@@ -23,40 +66,54 @@ class MoviePosterAPI:
             
         self.base_url = "https://api.themoviedb.org/3"
         
+    def _search_params(self, title, year=None):
+        """Build the query parameters for a TMDB movie search"""
+        params = {
+            'api_key': self.api_key,
+            'query': title,
+            'year': year if year else None,
+            'include_adult': False,
+            'language': 'en-US',
+            'page': 1
+        }
+        
+        # Remove None values from params
+        return {k: v for k, v in params.items() if v is not None}
+    
+    @staticmethod
+    def _poster_url(data, title):
+        """Extract the first result's poster URL from a search response"""
+        results = data.get('results', [])
+        
+        if not results:
+            logger.warning(f"No results found for movie: {title}")
+            return None
+            
+        # Get the first movie's poster path
+        poster_path = results[0].get('poster_path')
+        if poster_path:
+            return f"{POSTER_IMAGE_BASE_URL}{poster_path}"
+        
+        return None
+        
     def search_movie(self, title, year=None):
         """Search for a movie and get its poster"""
+        cached = _poster_cache.get(_cache_key(title, year), default=_MISS)
+        if cached is not _MISS:
+            return cached
+            
         try:
             # First search for the movie to get its ID
             search_url = f"{self.base_url}/search/movie"
-            params = {
-                'api_key': self.api_key,
-                'query': title,
-                'year': year if year else None,
-                'include_adult': False,
-                'language': 'en-US',
-                'page': 1
-            }
-            
-            # Remove None values from params
-            params = {k: v for k, v in params.items() if v is not None}
+            params = self._search_params(title, year)
             
             # Search for the movie
-            response = requests.get(search_url, params=params)
+            response = _SESSION.get(search_url, params=params, timeout=POSTER_REQUEST_TIMEOUT)
             response.raise_for_status()
             
-            data = response.json()
-            results = data.get('results', [])
-            
-            if not results:
-                logger.warning(f"No results found for movie: {title}")
-                return None
-                
-            # Get the first movie's poster path
-            poster_path = results[0].get('poster_path')
-            if poster_path:
-                return f"https://image.tmdb.org/t/p/w500{poster_path}"
-            
-            return None
+            poster_url = self._poster_url(response.json(), title)
+            _poster_cache.set(_cache_key(title, year), poster_url, expire=POSTER_CACHE_EXPIRE)
+            return poster_url
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Error searching for movie '{title}': {str(e)}")
@@ -67,13 +124,61 @@ class MoviePosterAPI:
         except Exception as e:
             logger.error(f"Unexpected error searching for movie '{title}': {str(e)}")
             return None
+    
+    def fetch_posters_bulk(self, titles_years):
+        """Get poster URLs for a list of (title, year) pairs, in order"""
+        # Answer from the disk cache first, including known misses, so
+        # only movies never looked up before reach the network
+        keys = [_cache_key(title, year) for title, year in titles_years]
+        posters = [_poster_cache.get(key, default=_MISS) for key in keys]
+        # Each movie is searched once even if it appears more than once
+        missing = {}
+        for key, title_year, poster in zip(keys, titles_years, posters):
+            if poster is _MISS:
+                missing.setdefault(key, title_year)
+        
+        if missing:
+            # Searches are network-bound, so threads overlap their round trips
+            # over the shared session's connection pool
+            workers = min(POSTER_FETCH_WORKERS, len(missing))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                fetched = dict(zip(
+                    missing,
+                    executor.map(lambda title_year: self.search_movie(*title_year), missing.values())
+                ))
+            posters = [
+                fetched[key] if poster is _MISS else poster
+                for key, poster in zip(keys, posters)
+            ]
+        
+        return posters
 
-@st.cache_data(ttl=3600)  # Cache results for 1 hour
-def get_movie_poster(api_token, title, year=None):
-    """Cached function to get movie poster URL"""
+@st.cache_resource
+def get_poster_api(api_token=None):
+    """Create the TMDB client once per API token and share it across reruns"""
+    return MoviePosterAPI(api_token)
+
+def prefetch_posters(api_token, titles_years):
+    """Warm the disk cache for the given movies on a background thread"""
+    poster_api = get_poster_api(api_token)
+    thread = threading.Thread(
+        target=poster_api.fetch_posters_bulk,
+        args=(titles_years,),
+        name="poster-prefetch",
+        daemon=True
+    )
+    thread.start()
+    return thread
+
+# Poster URLs depend only on the movie, so the API token is left out of the
+# cache keys (leading underscore) and a rotated token keeps the cache warm.
+# Persistence across restarts comes from the disk cache underneath.
+@st.cache_data(ttl=3600, max_entries=10000, show_spinner=False)  # Cache results for 1 hour
+def get_movie_posters(_api_token, titles_years):
+    """Cached function to get poster URLs for several movies concurrently"""
     try:
-        poster_api = MoviePosterAPI(api_token)
-        return poster_api.search_movie(title, year)
+        poster_api = get_poster_api(_api_token)
+        return poster_api.fetch_posters_bulk(titles_years)
     except Exception as e:
-        logger.error(f"Error getting movie poster: {str(e)}")
-        return None
+        logger.error(f"Error getting movie posters: {str(e)}")
+        return [None] * len(titles_years)
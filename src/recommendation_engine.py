@@ -1,94 +1,192 @@
 import numpy as np
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from fuzzywuzzy import process
+from sklearn.feature_extraction.text import TfidfVectorizer
+from rapidfuzz import fuzz, process, utils
 import logging
 import pandas as pd
-from functools import lru_cache
-import joblib
+from collections import OrderedDict
+import threading
+import hashlib
+import inspect
+import json
 import os
 from pathlib import Path
+from data_loader import build_title_index, normalize_title
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Most similar movies kept per movie, enough for the largest
+# recommendation list plus the movie itself and duplicate titles
+SIMILAR_MOVIES_K = 100
+
+# Movies scored against the whole catalogue per block while building
+SIMILARITY_BLOCK_SIZE = 256
+
+# Vocabularies up to this size are multiplied as dense arrays, where the
+# multithreaded BLAS product beats the sparse one
+DENSE_SIMILARITY_MAX_FEATURES = 1000
+
+# Movie columns the similarities are built from
+REQUIRED_COLUMNS = ['genres', 'year', 'averageRating', 'title']
+
+# Queries and matched movies whose results are kept per recommender
+RECOMMENDATION_CACHE_SIZE = 1000
+
 class MovieRecommender:
     CACHE_DIR = Path("cache")
-    SIMILARITY_MATRIX_FILE = CACHE_DIR / "similarity_matrix.joblib"
-    PROCESSED_DATA_FILE = CACHE_DIR / "processed_data.joblib"
+    SIMILARITY_INDICES_FILE = CACHE_DIR / "similarity_indices.npy"
+    SIMILARITY_SCORES_FILE = CACHE_DIR / "similarity_scores.npy"
+    PROCESSED_DATA_FILE = CACHE_DIR / "processed_data.parquet"
+    CACHE_META_FILE = CACHE_DIR / "similarity.meta.json"
     
-    def __init__(self, data):
-        """Initialize with movie data"""
+    def __init__(self, data, title_index=None):
+        """Initialize with movie data and optionally its prebuilt title index"""
         self.data = data
         self.processed_data = None
         self.similarity_matrix = None
         self._initialize_cache_dir()
         self._process_data()
+        self.title_index = title_index if title_index is not None else build_title_index(self.processed_data)
+        self.titles = list(self.title_index)
+        self.title_trigrams = build_title_trigrams(self.titles)
+        self.movie_columns = build_movie_columns(self.processed_data)
+        self._match_cache = OrderedDict()
+        self._recommendation_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
     
     def _initialize_cache_dir(self):
         """Create cache directory if it doesn't exist"""
         self.CACHE_DIR.mkdir(exist_ok=True)
     
+    def _cache_version(self):
+        """
+        Fingerprint the movie data and the code that builds the similarities,
+        so the cache is rebuilt when either changes
+        """
+        data_hash = hashlib.md5(
+            pd.util.hash_pandas_object(self.data[REQUIRED_COLUMNS], index=False).to_numpy().tobytes()
+        ).hexdigest()
+        code_hash = hashlib.md5(''.join(
+            [inspect.getsource(f) for f in (create_similarity_matrix, _create_content_strings, _top_k)]
+            + [str(SIMILAR_MOVIES_K)]
+        ).encode()).hexdigest()
+        return {'data': data_hash, 'code': code_hash}
+    
     def _load_cache(self):
-        """Load cached similarity matrix and processed data"""
+        """Load cached top-K similarities and processed data if they match the movie data"""
         try:
-            if self.SIMILARITY_MATRIX_FILE.exists() and self.PROCESSED_DATA_FILE.exists():
-                logger.info("Loading cached similarity matrix and processed data...")
-                self.similarity_matrix = joblib.load(self.SIMILARITY_MATRIX_FILE)
-                self.processed_data = joblib.load(self.PROCESSED_DATA_FILE)
+            cache_files = (
+                self.SIMILARITY_INDICES_FILE,
+                self.SIMILARITY_SCORES_FILE,
+                self.PROCESSED_DATA_FILE,
+                self.CACHE_META_FILE
+            )
+            if all(path.exists() for path in cache_files):
+                if json.loads(self.CACHE_META_FILE.read_text()) != self._cache_version():
+                    logger.info("Movie data or scoring changed, rebuilding similarities...")
+                    return False
+                logger.info("Loading cached similarities and processed data...")
+                # The arrays are memory-mapped, so only the rows queried
+                # are ever read from disk
+                self.similarity_matrix = (
+                    np.load(self.SIMILARITY_INDICES_FILE, mmap_mode='r'),
+                    np.load(self.SIMILARITY_SCORES_FILE, mmap_mode='r')
+                )
+                self.processed_data = pd.read_parquet(self.PROCESSED_DATA_FILE, memory_map=True)
                 return True
         except Exception as e:
             logger.warning(f"Failed to load cache: {e}")
         return False
     
     def _save_cache(self):
-        """Save similarity matrix and processed data to cache"""
+        """Save top-K similarities and processed data to cache"""
         try:
-            logger.info("Saving similarity matrix and processed data to cache...")
-            joblib.dump(self.similarity_matrix, self.SIMILARITY_MATRIX_FILE)
-            joblib.dump(self.processed_data, self.PROCESSED_DATA_FILE)
+            logger.info("Saving similarities and processed data to cache...")
+            indices, scores = self.similarity_matrix
+            np.save(self.SIMILARITY_INDICES_FILE, indices)
+            np.save(self.SIMILARITY_SCORES_FILE, scores)
+            self.processed_data.to_parquet(self.PROCESSED_DATA_FILE, compression='zstd')
+            self.CACHE_META_FILE.write_text(json.dumps(self._cache_version()))
         except Exception as e:
             logger.warning(f"Failed to save cache: {e}")
     
     def _process_data(self):
-        """Process the data and create similarity matrix with caching"""
+        """Process the data and create top-K similarities with caching"""
         if self._load_cache():
             return
             
         try:
-            logger.info("Processing data and creating similarity matrix...")
+            logger.info("Processing data and creating similarities...")
             self.processed_data, self.similarity_matrix = create_similarity_matrix(self.data)
             self._save_cache()
         except Exception as e:
             logger.error(f"Error processing data: {str(e)}")
             raise
     
-    @lru_cache(maxsize=1000)
-    def find_similar_movies(self, title, max_recommendations=10):
+    def find_similar_movies(self, title, max_recommendations=10, exact_match=False):
         """Find similar movies based on title with caching"""
         try:
-            return get_recommendations(
-                title, 
-                self.processed_data,
-                self.similarity_matrix,
-                max_recommendations=max_recommendations
+            # Titles are matched once per normalized query, and results are
+            # cached per matched movie, so different spellings that resolve
+            # to the same movie share one entry
+            title = normalize_title(title) if isinstance(title, str) else title
+            movie_idx = self._cached(
+                self._match_cache,
+                (title, exact_match),
+                lambda: find_movie_index(
+                    title,
+                    self.title_index,
+                    title_trigrams=self.title_trigrams,
+                    exact_match=exact_match,
+                    titles=self.titles
+                )
+            )
+            if movie_idx is None:
+                return []
+            
+            return self._cached(
+                self._recommendation_cache,
+                (movie_idx, max_recommendations),
+                lambda: recommend_similar_movies(
+                    movie_idx,
+                    self.movie_columns,
+                    self.similarity_matrix,
+                    max_recommendations=max_recommendations
+                )
             )
         except Exception as e:
             logger.error(f"Error finding similar movies: {str(e)}")
             return []
+    
+    def _cached(self, cache, key, compute):
+        """Get a value from one of the instance caches, computing it on a miss"""
+        with self._cache_lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+        
+        value = compute()
+        
+        with self._cache_lock:
+            cache[key] = value
+            if len(cache) > RECOMMENDATION_CACHE_SIZE:
+                cache.popitem(last=False)
+        return value
 
 def create_similarity_matrix(data):
-    """Create a similarity matrix based on movie content"""
+    """
+    Create the top-K similarity matrix based on movie content, as an
+    (indices, scores) pair of arrays with one row per movie
+    """
     try:
         # Ensure we have the required columns
-        required_columns = ['genres', 'year', 'averageRating', 'title']
-        missing_columns = [col for col in required_columns if col not in data.columns]
+        missing_columns = [col for col in REQUIRED_COLUMNS if col not in data.columns]
         if missing_columns:
             raise ValueError(f"Missing required columns: {missing_columns}")
 
         # Create content string for each movie
         logger.info("Creating content strings...")
-        data['content'] = data.apply(_create_content_string, axis=1)
+        data = data.assign(content=_create_content_strings(data))
         
         # Remove any rows where content is empty
         data = data[data['content'].str.len() > 0].copy()
@@ -98,114 +196,242 @@ def create_similarity_matrix(data):
         
         logger.info(f"Processing {len(data)} movies...")
         
-        # Create the vectorizer with specific stop words and token pattern
-        count_vectorizer = CountVectorizer(
+        # Create a TF-IDF vectorizer with whitespace tokens and idf weighting
+        # turned off, so it yields the token counts of each movie already
+        # L2-normalized and cosine similarity is a plain dot product
+        vectorizer = TfidfVectorizer(
             tokenizer=lambda x: x.split(),
             token_pattern=None,  # Disable default token pattern
             stop_words=None,  # Don't use default stop words
             min_df=1,  # Include all terms
-            max_features=5000  # Limit features for better performance
+            max_features=5000,  # Limit features for better performance
+            use_idf=False,
+            norm='l2'
         )
         
-        # Create the count matrix
-        count_matrix = count_vectorizer.fit_transform(data['content'])
+        # Create the L2-normalized count matrix
+        normalized = vectorizer.fit_transform(data['content'])
         
-        if count_matrix.shape[1] == 0:
+        if normalized.shape[1] == 0:
             raise ValueError("No valid features extracted from movie content")
         
-        logger.info(f"Created matrix with shape: {count_matrix.shape}")
+        logger.info(f"Created matrix with shape: {normalized.shape}")
         
-        # Calculate similarity
-        similarity_matrix = cosine_similarity(count_matrix, count_matrix)
+        # Calculate cosine similarity block by block, keeping only the most
+        # similar movies of each row, so the full N x N matrix never exists
+        if normalized.shape[1] <= DENSE_SIMILARITY_MAX_FEATURES:
+            normalized = normalized.toarray()
+        k = min(SIMILAR_MOVIES_K, normalized.shape[0])
+        indices = np.empty((normalized.shape[0], k), dtype=np.int32)
+        # Scores are ranked at full precision but stored as float32, which
+        # is plenty for display and halves the cached arrays
+        scores = np.empty((normalized.shape[0], k), dtype=np.float32)
+        for start in range(0, normalized.shape[0], SIMILARITY_BLOCK_SIZE):
+            block = normalized[start:start + SIMILARITY_BLOCK_SIZE] @ normalized.T
+            if not isinstance(block, np.ndarray):
+                block = block.toarray()
+            for offset, row in enumerate(block):
+                top = _top_k(row, k)
+                indices[start + offset] = top
+                scores[start + offset] = row[top]
         
-        return data, similarity_matrix
+        # Content strings are only needed to build the counts, so they are
+        # not kept with the processed data that gets cached
+        return data.drop(columns='content'), (indices, scores)
         
     except Exception as e:
         logger.error(f"Error creating similarity matrix: {str(e)}")
         raise
 
-def _create_content_string(row):
-    """Create a content string for a movie with weighted features"""
+def _trigrams(title):
+    """Get the set of 3-character substrings of a title as fuzzy matching sees it"""
+    processed = utils.default_process(title)
+    return {processed[i:i + 3] for i in range(len(processed) - 2)}
+
+def build_title_trigrams(titles):
+    """Map each title trigram to the positions of the titles containing it"""
+    title_trigrams = {}
+    for position, title in enumerate(titles):
+        for trigram in _trigrams(title):
+            title_trigrams.setdefault(trigram, []).append(position)
+    return title_trigrams
+
+def _title_candidates(title, titles, title_trigrams):
+    """Get the titles sharing a trigram with the query, or None to scan them all"""
+    positions = set().union(*(title_trigrams.get(trigram, ()) for trigram in _trigrams(title)))
+    if not positions or len(positions) > len(titles) // 2:
+        return None
+    # The prefilter is approximate: titles sharing no trigram with the query
+    # are never scored, so when scores tie the best candidate can differ
+    # from the best match of a full scan. Candidates keep the order of the
+    # titles so ties among them resolve as a full scan would
+    return [titles[position] for position in sorted(positions)]
+
+def _closest_title(title, choices, min_similarity):
+    """Get the best fuzzy match among the choices, or None below the cutoff"""
+    return process.extractOne(
+        title,
+        choices,
+        scorer=fuzz.WRatio,
+        processor=utils.default_process,
+        score_cutoff=min_similarity
+    )
+
+def _top_k(scores, k):
+    """Get the indices of the k highest scores, best first, ties by lowest index"""
+    kth = np.partition(scores, -k)[-k]
+    candidates = np.flatnonzero(scores >= kth)
+    return candidates[np.argsort(-scores[candidates], kind='stable')][:k]
+
+def _create_content_strings(data):
+    """Create the content strings for all movies with weighted features"""
     try:
-        content_parts = []
+        # Features are built column-wise; each token is repeated by its
+        # weight and missing values contribute no tokens
         
         # Add genres (highest weight)
-        if pd.notna(row['genres']):
-            genres = str(row['genres']).split()
-            content_parts.extend([genre.lower() for genre in genres] * 3)
+        genres = data['genres'].astype('string').str.lower() + ' '
+        content = (genres * 3).fillna('')
         
         # Add year (medium weight)
-        if pd.notna(row['year']):
-            year = str(int(row['year']))
-            content_parts.extend([f"year_{year}"] * 2)
+        year = 'year_' + data['year'].astype('Int64').astype('string') + ' '
+        content += (year * 2).fillna('')
         
         # Add rating (lower weight)
-        if pd.notna(row['averageRating']):
-            rating = int(float(row['averageRating']) * 2)
-            content_parts.append(f"rating_{rating}")
+        rating = np.trunc(data['averageRating'].astype('float64') * 2).astype('Int64')
+        content += ('rating_' + rating.astype('string')).fillna('')
         
-        # Join all parts with spaces
-        content = ' '.join(content_parts)
+        content = content.str.strip().astype(object)
         
-        if not content:
-            logger.warning(f"Empty content string created for movie: {row.get('title', 'Unknown')}")
+        empty = (content == '').sum()
+        if empty:
+            logger.warning(f"Empty content strings created for {empty} movies")
             
         return content
         
     except Exception as e:
-        logger.error(f"Error creating content string for movie {row.get('title', 'Unknown')}: {str(e)}")
-        return ""
+        logger.error(f"Error creating content strings: {str(e)}")
+        raise
 
-def get_recommendations(title, data, similarity_matrix, min_similarity=70, max_recommendations=10):
-    """Get movie recommendations based on title"""
+def get_recommendations(title, data, similarity_matrix, title_index, min_similarity=70, max_recommendations=10, title_trigrams=None, exact_match=False, titles=None):
+    """Get movie recommendations based on title, skipping fuzzy matching for titles known to exist"""
     try:
-        if not isinstance(title, str) or not title.strip():
-            raise ValueError("Invalid title: must be a non-empty string")
+        movie_idx = find_movie_index(
+            title,
+            title_index,
+            min_similarity=min_similarity,
+            title_trigrams=title_trigrams,
+            exact_match=exact_match,
+            titles=titles
+        )
+        if movie_idx is None:
+            return []
+        
+        return recommend_similar_movies(
+            movie_idx,
+            build_movie_columns(data),
+            similarity_matrix,
+            max_recommendations=max_recommendations
+        )
             
-        title_to_index = {row['title']: idx for idx, row in data.iterrows()}
+    except Exception as e:
+        logger.error(f"Error in get_recommendations: {str(e)}")
+        return []
 
-        # Find closest match using fuzzy matching
-        closest_match = process.extractOne(title, list(title_to_index.keys()))
-        if not closest_match or closest_match[1] < min_similarity:
+def find_movie_index(title, title_index, min_similarity=70, title_trigrams=None, exact_match=False, titles=None):
+    """Find the row of the movie best matching a title, or None if nothing matches"""
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError("Invalid title: must be a non-empty string")
+        
+    # An exact title needs no fuzzy matching
+    movie_idx = title_index.get(normalize_title(title))
+    
+    if movie_idx is None and exact_match:
+        logger.info(f"No movie found with title: {title}")
+        return None
+    
+    if movie_idx is None:
+        # Find closest match using fuzzy matching; titles scoring below
+        # the cutoff are skipped early instead of fully scored. Titles
+        # sharing a trigram with the query are tried first, and all
+        # titles only if none of them match. The ordered titles the
+        # trigrams refer to are built from the index unless passed in
+        if title_trigrams:
+            candidates = _title_candidates(title, titles if titles is not None else list(title_index), title_trigrams)
+        else:
+            candidates = None
+        closest_match = _closest_title(title, candidates, min_similarity) if candidates else None
+        if closest_match is None:
+            closest_match = _closest_title(title, title_index.keys(), min_similarity)
+        if closest_match is None:
             logger.info(f"No close matches found for title: {title}")
-            return []
+            return None
+        
+        movie_idx = title_index[closest_match[0]]
+    
+    return movie_idx
 
-        matched_title = closest_match[0]
-        movie_idx = title_to_index[matched_title]
+def build_movie_columns(data):
+    """
+    Extract the fields shown for a recommendation as one array per field,
+    already converted to the values each recommendation carries
+    """
+    # Genre combinations repeat across many movies, so each distinct
+    # string is split once and its list shared
+    split_genres = {}
+    genres = [
+        split_genres.setdefault(g, g.split()) if isinstance(g, str) else []
+        for g in data['genres'].tolist()
+    ]
+    # Years and ratings are converted to plain Python numbers once here,
+    # with missing values as None, instead of per recommendation
+    return {
+        'title': data['title'].to_numpy(),
+        'year': data['year'].astype('Int64').to_numpy(dtype=object, na_value=None),
+        'genres': genres,
+        'rating': [
+            round(rating, 1) if pd.notna(rating) else None
+            for rating in data['averageRating'].astype('float64').tolist()
+        ]
+    }
 
-        # Get similarity scores
-        similarity_scores = list(enumerate(similarity_matrix[movie_idx]))
-        sorted_scores = sorted(similarity_scores, key=lambda x: x[1], reverse=True)
+def recommend_similar_movies(movie_idx, movie_columns, similarity_matrix, max_recommendations=10):
+    """Get the movies most similar to the movie at a row"""
+    # Get the stored most similar movies, already sorted by score
+    indices, scores = similarity_matrix
+    sorted_scores = zip(indices[movie_idx], scores[movie_idx])
 
-        recommendations = []
-        seen_titles = set()  # To avoid duplicate recommendations
+    # Column arrays are indexed directly in the loop instead of
+    # materializing a pandas row per candidate
+    titles = movie_columns['title']
+    years = movie_columns['year']
+    genres = movie_columns['genres']
+    ratings = movie_columns['rating']
 
-        for idx, score in sorted_scores:
-            if len(recommendations) >= max_recommendations:
-                break
-                
-            if idx == movie_idx:  # Skip the searched movie itself
-                continue
+    recommendations = []
+    seen_titles = set()  # To avoid duplicate recommendations
 
-            movie = data.iloc[idx]
-            title = movie['title']
-            
-            # Skip if we've already recommended this title
-            if title in seen_titles:
-                continue
-                
-            seen_titles.add(title)
+    for idx, score in sorted_scores:
+        if len(recommendations) >= max_recommendations:
+            break
             
-            recommendations.append({
-                'title': title,
-                'year': int(movie['year']) if pd.notna(movie['year']) else None,
-                'genres': movie['genres'].split() if pd.notna(movie['genres']) else [],
-                'rating': float(movie['averageRating']) if pd.notna(movie['averageRating']) else None,
-                'similarity_score': float(score)
-            })
-
-        return recommendations
+        if idx == movie_idx:  # Skip the searched movie itself
+            continue
+
+        title = titles[idx]
+        
+        # Skip if we've already recommended this title
+        if title in seen_titles:
+            continue
             
-    except Exception as e:
-        logger.error(f"Error in get_recommendations: {str(e)}")
-        return []
\ No newline at end of file
+        seen_titles.add(title)
+        
+        recommendations.append({
+            'title': title,
+            'year': years[idx],
+            'genres': list(genres[idx]),
+            'rating': ratings[idx],
+            'similarity_score': float(score)
+        })
+
+    return recommendations